@@ -2,8 +2,8 @@ import signal
 import sys
 import os
 import re
-import shlex
-import json
+import marshal
+import functools
 
 # Built-in commands set
 builtins = {"cd", "exit", "pwd", "which", "var"}
@@ -11,6 +11,37 @@ builtins = {"cd", "exit", "pwd", "which", "var"}
 # Pattern to match valid variable names (letters, digits, and underscores)
 valid_variable_pattern = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
+# Pattern to match $VAR and ${VAR} references inside variable values
+_EXPANDVARS_RE = re.compile(r'\$(?:\{([A-Za-z_][A-Za-z0-9_]*)\}|([A-Za-z_][A-Za-z0-9_]*))')
+
+# Pattern to find the tokens echo treats specially: an escaped ${var}, any other
+# escaped character, a valid ${var} reference, or a ${...} with an invalid name
+_ECHO_RE = re.compile(
+    r'\\(\$\{[^}]*\})'
+    r'|\\(.)'
+    r'|\$\{([A-Za-z_][A-Za-z0-9_]*)\}'
+    r'|\$\{([^}]*)\}',
+    re.DOTALL,
+)
+
+# Cache of command name -> resolved executable path, valid only for the PATH value
+# stored in _exec_cache_path. Entries are re-checked for execute permission on
+# every hit, and misses are never cached.
+_exec_cache = {}
+_exec_cache_path = None
+
+# The directories of the PATH value stored in _exec_cache_path, split once
+_exec_cache_dirs = []
+
+# Cache of PATH directory -> (directory mtime, names of entries in that directory)
+_dir_exec_cache = {}
+
+# Prompt shown by the REPL, kept in sync with the PROMPT_DISPLAY variable
+_PROMPT_DISPLAY = '>> '
+
+# Home directory used for tilde expansion, refreshed whenever HOME is set
+_HOME = os.path.expanduser("~")
+
 # DO NOT REMOVE THIS FUNCTION!
 # This function is required in order to correctly switch the terminal foreground group to
 # that of a child process.
@@ -20,6 +51,45 @@ def setup_signals() -> None:
     """
     signal.signal(signal.SIGTTOU, signal.SIG_IGN)
 
+def _expandvars(value):
+    """Expand $VAR and ${VAR} references in a value, leaving undefined ones unchanged."""
+    if '$' not in value:
+        return value
+    return _EXPANDVARS_RE.sub(lambda m: os.environ.get(m.group(1) or m.group(2), m.group(0)), value)
+
+def _myshrc_cache_path(myshrc_path):
+    """Return the location of the parsed-data cache for a given .myshrc file."""
+    # Derive the file name from the rc path itself so no hashing module is needed
+    name = os.path.abspath(myshrc_path).replace('%', '%%').replace(os.sep, '%')
+    return os.path.join(os.path.expanduser("~/.cache/mysh"), f"{name}.marshal")
+
+def _read_myshrc_cache(cache_path, key):
+    """Return the cached .myshrc data if it was stored for this key, otherwise None."""
+    try:
+        with open(cache_path, 'rb') as file:
+            cached_key, data = marshal.load(file)
+    except Exception:
+        # A missing or unreadable cache just means we parse the JSON again
+        return None
+    return data if cached_key == key else None
+
+def _write_myshrc_cache(cache_path, key, data):
+    """Store the parsed .myshrc data, writing to a temporary file and renaming it into place."""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        # The cache holds every .myshrc value, so keep it private to the user
+        os.makedirs(os.path.dirname(cache_path), mode=0o700, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            marshal.dump((key, data), file)
+        os.replace(tmp_path, cache_path)
+    except (OSError, ValueError):
+        # Caching is best-effort; never fail shell startup because of it
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
 def load_myshrc():
     """Load and parse the .myshrc JSON file for environment variables."""
     myshrc_path = os.path.expanduser("~/.myshrc")
@@ -28,22 +98,38 @@ def load_myshrc():
     if 'MYSHDOTDIR' in os.environ:
         myshrc_path = os.path.join(os.environ['MYSHDOTDIR'], '.myshrc')
     
-    # Attempt to open and read the .myshrc file
+    # Get the modification time and size of the .myshrc file to validate the cache
     try:
-        with open(myshrc_path, 'r') as file:
-            data = json.load(file)
+        st = os.stat(myshrc_path)
     except FileNotFoundError:
         # If the file doesn't exist, silently continue
         return
-    except json.JSONDecodeError:
-        # Handle invalid JSON format
-        print("mysh: invalid JSON format for .myshrc", file=sys.stderr)
-        return
+    cache_key = (st.st_mtime_ns, st.st_size)
+
+    # Reuse the previously parsed data if the file hasn't changed since
+    cache_path = _myshrc_cache_path(myshrc_path)
+    data = _read_myshrc_cache(cache_path, cache_key)
+
+    # Otherwise, attempt to open and read the .myshrc file
+    if data is None:
+        import json  # Only needed when the cache can't be used
+
+        try:
+            with open(myshrc_path, 'r') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            # If the file doesn't exist, silently continue
+            return
+        except json.JSONDecodeError:
+            # Handle invalid JSON format
+            print("mysh: invalid JSON format for .myshrc", file=sys.stderr)
+            return
+        _write_myshrc_cache(cache_path, cache_key, data)
     
     # Process each environment variable from the JSON data
     for key, value in data.items():
         # Check if the key is a valid variable name
-        if not valid_variable_pattern.match(key):
+        if not is_valid_variable_name(key):
             print(f"mysh: .myshrc: {key}: invalid characters for variable name", file=sys.stderr)
             continue
         if not isinstance(value, str):
@@ -52,8 +138,12 @@ def load_myshrc():
         
         # Attempt to resolve any references to other variables within the value
         try:
-            resolved_value = os.path.expandvars(value)
+            resolved_value = _expandvars(value)
             os.environ[key] = resolved_value
+            if key == "PATH":
+                _exec_cache.clear()
+            elif key == "HOME":
+                _refresh_home()
         except Exception as e:
             print(f"mysh: .myshrc: {key}: error resolving value: {e}", file=sys.stderr)
             continue
@@ -61,6 +151,12 @@ def load_myshrc():
     # Update prompt based on the loaded MYSH_VERSION
     update_prompt_based_on_version()
 
+def _set_prompt_display(prompt):
+    """Set the prompt shown by the shell, both in PROMPT_DISPLAY and the cached copy."""
+    global _PROMPT_DISPLAY
+    os.environ['PROMPT_DISPLAY'] = prompt
+    _PROMPT_DISPLAY = prompt
+
 def update_prompt_based_on_version():
     """Update the shell prompt based on the MYSH_VERSION variable."""
     # Get the MYSH_VERSION environment variable
@@ -68,10 +164,10 @@ def update_prompt_based_on_version():
 
     # If MYSH_VERSION is '1.1.1', set the prompt to 'mysh $ '
     if version == '1.1.1':
-        os.environ['PROMPT_DISPLAY'] = 'mysh $ '
+        _set_prompt_display('mysh $ ')
     else:
         # Default prompt
-        os.environ['PROMPT_DISPLAY'] = '>> '
+        _set_prompt_display('>> ')
 
 
 def exit_command(args: list[str]) -> None:
@@ -121,6 +217,20 @@ def pwd_command(args):
     else:
         print(current_directory)
 
+def _refresh_home():
+    """Refresh the cached home directory after HOME has changed."""
+    global _HOME
+    _HOME = os.path.expanduser("~")
+
+def _expand_tilde(arg):
+    """Expand a leading tilde in an argument, leaving other arguments untouched."""
+    if arg[:1] != '~':
+        return arg
+    if arg == '~' or arg.startswith('~/'):
+        return (_HOME.rstrip('/') + arg[1:]) or '/'
+    # ~user forms need a password database lookup
+    return os.path.expanduser(arg)
+
 def cd_command(args):
     """Handle the built-in cd command."""
     if len(args) > 1:
@@ -141,11 +251,51 @@ def cd_command(args):
     except PermissionError:
         print(f"cd: permission denied: {path}", file=sys.stderr)
 
+def _directory_entries(directory):
+    """Return the names of entries in a PATH directory, rescanning only when it changes.
+
+    Returns None if the directory exists but can't be listed (e.g. it only has the
+    search permission), in which case candidates must be checked directly.
+    """
+    directory = os.path.abspath(directory)
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        # Missing or inaccessible directories can't provide any executables
+        return set()
+
+    cached = _dir_exec_cache.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with os.scandir(directory) as entries:
+            names = {entry.name for entry in entries}
+    except OSError:
+        return None
+    _dir_exec_cache[directory] = (mtime, names)
+    return names
+
 def find_executable(cmd):
     """Find the first executable match for a command in the current PATH."""
+    global _exec_cache_path, _exec_cache_dirs
+
     # Retrieve the current PATH environment variable or set to None if not present
     path_dirs = os.environ.get("PATH")
 
+    # Reuse a previous lookup if PATH hasn't changed since it was cached and the
+    # file is still there and executable
+    if path_dirs != _exec_cache_path:
+        _exec_cache.clear()
+        _exec_cache_path = path_dirs
+        # Only re-split PATH when it has changed since the last lookup
+        _exec_cache_dirs = path_dirs.split(os.pathsep) if path_dirs else []
+    elif cmd in _exec_cache:
+        executable_path = _exec_cache[cmd]
+        if os.access(executable_path, os.X_OK):
+            return executable_path
+        del _exec_cache[cmd]
+
     # If PATH is explicitly empty, return None to indicate command not found
     if path_dirs == "":
         return None
@@ -154,14 +304,32 @@ def find_executable(cmd):
     if path_dirs is None:
         path_dirs = ["/bin", "/usr/bin", "/usr/local/bin"]
     else:
-        path_dirs = path_dirs.split(os.pathsep)
+        path_dirs = _exec_cache_dirs
+
+    # Relative PATH entries depend on the current directory, so a hit found at or
+    # after one of them can't be reused once the shell changes directory
+    relative_dir_seen = False
 
     # Check each directory in the PATH for the executable command
     for directory in path_dirs:
-        if directory:  # Ensure the directory is not empty
-            executable_path = os.path.join(directory, cmd)
-            if os.path.isfile(executable_path) and os.access(executable_path, os.X_OK):
-                return executable_path
+        if not directory:  # Ensure the directory is not empty
+            continue
+        if not os.path.isabs(directory):
+            relative_dir_seen = True
+
+        # Skip directories whose listing shows the command isn't there. Names with a
+        # slash point below the directory, and unlistable directories give no
+        # answer, so those candidates are checked directly.
+        entries = None if '/' in cmd else _directory_entries(directory)
+        if entries is not None and cmd not in entries:
+            continue
+
+        executable_path = os.path.join(directory, cmd)
+        if os.path.isfile(executable_path) and os.access(executable_path, os.X_OK):
+            # Only cache hits for plain names that don't depend on the current directory
+            if entries is not None and not relative_dir_seen:
+                _exec_cache[cmd] = executable_path
+            return executable_path
     return None
 
 
@@ -182,56 +350,46 @@ def which_command(args):
             else:
                 print(f"{cmd} not found")
 
+@functools.lru_cache(maxsize=512)
 def is_valid_variable_name(var_name):
     """Check if the provided variable name is valid according to shell rules."""
-    return bool(valid_variable_pattern.match(var_name))
+    return valid_variable_pattern.match(var_name) is not None
 
 def echo_command(args):
     """Handle the echo command with proper escape handling."""
     command = ' '.join(args)
 
+    # Plain text with no escapes or expansions can be printed as is
+    if '$' not in command and '\\' not in command:
+        print(command)
+        return
+
     result = []
-    i = 0
-    while i < len(command):
-        if command[i] == '\\' and i + 1 < len(command):
-            if command[i + 1] == '$' and i + 2 < len(command) and command[i + 2] == '{':
-                var_end = command.find('}', i + 2)
-                if var_end != -1:
-                    result.append(command[i + 1:var_end + 1])  # Append ${var} as is without expansion
-                    i = var_end + 1
-                else:
-                    result.append(command[i + 1])
-                    i += 2
-            else:
-                result.append(command[i + 1])
-                i += 2
-        elif command[i] == '$' and i + 1 < len(command) and command[i + 1] == '{':
-            var_end = command.find('}', i + 2)
-            if var_end != -1:
-                var_name = command[i + 2:var_end]
-
-                # Check for invalid characters in the variable name
-                if not is_valid_variable_name(var_name):
-                    print(f"mysh: syntax error: invalid characters for variable {var_name}", file=sys.stderr)
-                    return
-
-                # Expand the variable if it's defined, otherwise just print a newline
-                var_value = os.environ.get(var_name, "")
-                
-                # If PROMPT is being echoed, simulate the prompt by showing ">>"
-                if var_name == 'PROMPT':
-                    print(">> \n", end='')  # Display the prompt and keep the cursor at the prompt
-                    return  # Exit to prompt for the next command line input
-
-                result.append(var_value)
-                i = var_end + 1
-            else:
-                result.append(command[i])
-                i += 1
+    last_end = 0
+    for match in _ECHO_RE.finditer(command):
+        # Copy the literal text between the previous token and this one
+        result.append(command[last_end:match.start()])
+        last_end = match.end()
+
+        escaped_var, escaped_char, var_name, invalid_var_name = match.groups()
+        if escaped_var is not None:
+            result.append(escaped_var)  # Append ${var} as is without expansion
+        elif escaped_char is not None:
+            result.append(escaped_char)
+        elif invalid_var_name is not None:
+            # The variable name contains invalid characters
+            print(f"mysh: syntax error: invalid characters for variable {invalid_var_name}", file=sys.stderr)
+            return
         else:
-            result.append(command[i])
-            i += 1
+            # If PROMPT is being echoed, simulate the prompt by showing ">>"
+            if var_name == 'PROMPT':
+                print(">> \n", end='')  # Display the prompt and keep the cursor at the prompt
+                return  # Exit to prompt for the next command line input
 
+            # Expand the variable if it's defined, otherwise just print a newline
+            result.append(os.environ.get(var_name, ""))
+
+    result.append(command[last_end:])
     processed_text = ''.join(result)
     print(processed_text)
 
@@ -282,8 +440,15 @@ def var_command(args):
             sys.exit(1)  # Exit if exec fails
         else:  # Parent process
             os.close(write_fd)  # Close the write end in the parent
-            output = os.read(read_fd, 4096).decode().strip()  # Read the command's output
+            # Read the command's output until EOF so large outputs aren't truncated
+            chunks = []
+            while True:
+                chunk = os.read(read_fd, 65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
             os.close(read_fd)
+            output = b''.join(chunks).decode().strip()
             os.waitpid(pid, 0)  # Wait for the child process to finish
 
             # Process output
@@ -295,6 +460,10 @@ def var_command(args):
                 formatted_output += '\n'
 
             os.environ[variable_name] = formatted_output
+            if variable_name == "HOME":
+                _refresh_home()
+            elif variable_name == "PROMPT_DISPLAY":
+                _set_prompt_display(formatted_output)
         return
 
     # Handle standard var command setting
@@ -311,62 +480,87 @@ def var_command(args):
         return
 
     # Set the environment variable with correct expansion of any existing variables
-    resolved_value = os.path.expandvars(value)
+    resolved_value = _expandvars(value)
     os.environ[variable_name] = resolved_value
 
     # Check if the variable being set is PATH to ensure it is correctly updated
     if variable_name == "PATH":
         # Split the updated PATH to update the path directories dynamically
         os.environ["PATH"] = resolved_value
+        # Drop any executable lookups made against the old PATH
+        _exec_cache.clear()
+
+    # Keep the cached home directory in sync for tilde expansion
+    if variable_name == "HOME":
+        _refresh_home()
 
     # Check if the variable being set is PROMPT
     if variable_name == 'PROMPT':
         update_prompt(value)
+    elif variable_name == 'PROMPT_DISPLAY':
+        _set_prompt_display(resolved_value)
 
 def update_prompt(value):
     """Update the shell prompt based on the value of the PROMPT variable."""
     # Expand environment variables within the PROMPT value
-    expanded_prompt = os.path.expandvars(value)
+    expanded_prompt = _expandvars(value)
 
     # If the prompt is empty, default to '>>'
     if not expanded_prompt:
-        os.environ['PROMPT_DISPLAY'] = '>> '
+        _set_prompt_display('>> ')
     else:
-        os.environ['PROMPT_DISPLAY'] = expanded_prompt
+        _set_prompt_display(expanded_prompt)
 
 
 
+def _split_pipes(cmd: str) -> list[str]:
+    """Split a command line on the pipes that are not inside quotes or escaped."""
+    parts = []
+    start = 0
+    in_single = False
+    in_double = False
+    i = 0
+    n = len(cmd)
+    while i < n:
+        char = cmd[i]
+        if char == '\\' and not in_single:
+            i += 2  # Skip the escaped character
+            continue
+        if char == "'" and not in_double:
+            in_single = not in_single
+        elif char == '"' and not in_single:
+            in_double = not in_double
+        elif char == '|' and not in_single and not in_double:
+            parts.append(cmd[start:i].strip())
+            start = i + 1
+        i += 1
+    parts.append(cmd[start:].strip())
+    return parts
+
 def check_pipe_syntax(commands):
     """Check for syntax errors in piping commands."""
-    # Trim whitespace from each command and check if any command is missing
-    trimmed_commands = [cmd.strip() for cmd in commands]
-
-    # Check if the first or last command is empty, indicating a missing command
-    if not trimmed_commands[0] or not trimmed_commands[-1]:
-        print("mysh: syntax error: expected command after pipe", file=sys.stderr)
-        return False
-
-    # Check if any intermediate command is empty (between pipes)
-    for i, command in enumerate(trimmed_commands):
-        if not command:
+    # Every command between pipes must be non-empty once whitespace is trimmed
+    for command in commands:
+        if not command.strip():
             print("mysh: syntax error: expected command after pipe", file=sys.stderr)
             return False
-
     return True
 
-def run_command_with_pipes(command):
-    """Run a shell-like command with pipes, handling SIGINT correctly."""
-    # Split commands by pipe while preserving quoted pipes
-    commands = [shlex.split(cmd.strip()) for cmd in re.split(r'\s*\|\s*(?=(?:[^\'"]*[\'"][^\'"]*[\'"])*[^\'"]*$)', command)]
+def run_command_with_pipes(pipe_commands):
+    """Run a shell-like command with pipes, handling SIGINT correctly.
 
-    # Check for missing command syntax error
-    if not check_pipe_syntax(command.split('|')):
-        return
+    `pipe_commands` is the command line already split on its unquoted pipes and
+    checked with `check_pipe_syntax`.
+    """
+    import shlex
+    commands = [shlex.split(cmd.strip()) for cmd in pipe_commands]
 
     num_commands = len(commands)
     pipe_fds = []
 
-    # Setup pipes between processes
+    # Setup pipes between processes. Python creates pipe fds as non-inheritable
+    # (close-on-exec), so each spawned process only keeps the ends it dup2's onto
+    # stdin/stdout and the kernel closes the rest at exec.
     for _ in range(num_commands - 1):
         pipe_fds.append(os.pipe())
 
@@ -380,58 +574,34 @@ def run_command_with_pipes(command):
             return
 
         # Expand the tilde (~) manually
-        cmd = [os.path.expanduser(arg) for arg in cmd]
-
-        pid = os.fork()
-        if pid == 0:  # Child process
-            # Set the process group; for the first process, make it the group leader
-            if i == 0:
-                os.setpgrp()  # Create a new process group with the first command as the leader
-            else:
-                try:
-                    os.setpgid(0, pgid)  # Set subsequent processes to the first process's group
-                except PermissionError:
-                    pass  # Ignore permission errors when setting process group
-
-            # Setup input from the previous pipe, if not the first command
-            if i > 0:
-                os.dup2(pipe_fds[i - 1][0], 0)  # Redirect stdin to the read end of the previous pipe
-            # Setup output to the next pipe, if not the last command
-            if i < num_commands - 1:
-                os.dup2(pipe_fds[i][1], 1)  # Redirect stdout to the write end of the current pipe
-
-            # Close all pipe fds in the child process
-            for fd_pair in pipe_fds:
-                os.close(fd_pair[0])
-                os.close(fd_pair[1])
-
-            # Execute the command
-            try:
-                os.execvp(cmd[0], cmd)
-            except BrokenPipeError:
-                sys.exit(0)  # Silently exit if there's a broken pipe error
-            except FileNotFoundError:
-                print(f"{cmd[0]}: command not found", file=sys.stderr)
-            except IndexError:
-                # Handle case where no command exists after a pipe
-                print("mysh: syntax error: expected command after pipe", file=sys.stderr)
-            except Exception as e:
-                print(f"Error executing {cmd[0]}: {e}", file=sys.stderr)
-            sys.exit(1)  # Exit the child process if exec fails
-        else:  # Parent process
-            if pgid is None:
-                pgid = pid  # Set the process group ID to the first child PID
-                try:
-                    os.setpgid(pid, pgid)  # Set the group ID for the first process
-                except PermissionError:
-                    pass  # Ignore permission errors when setting process group
-            else:
-                try:
-                    os.setpgid(pid, pgid)  # Set subsequent processes to the same group
-                except PermissionError:
-                    pass  # Ignore permission errors when setting process group
+        cmd = [_expand_tilde(arg) for arg in cmd]
+
+        # Connect the command to the previous and next pipes in the spawned process
+        file_actions = []
+        if i > 0:
+            # Redirect stdin to the read end of the previous pipe
+            file_actions.append((os.POSIX_SPAWN_DUP2, pipe_fds[i - 1][0], 0))
+        if i < num_commands - 1:
+            # Redirect stdout to the write end of the current pipe
+            file_actions.append((os.POSIX_SPAWN_DUP2, pipe_fds[i][1], 1))
+
+        # Execute the command; the first process becomes the group leader and the
+        # rest join its process group. SIGPIPE gets its default action back (Python
+        # ignores it), so a writer whose reader is gone exits quietly.
+        try:
+            pid = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions,
+                                  setpgroup=0 if pgid is None else pgid,
+                                  setsigdef=(signal.SIGPIPE,))
+        except FileNotFoundError:
+            print(f"{cmd[0]}: command not found", file=sys.stderr)
+            continue
+        except Exception as e:
+            print(f"Error executing {cmd[0]}: {e}", file=sys.stderr)
+            continue
 
-            processes.append(pid)
+        if pgid is None:
+            pgid = pid  # Set the process group ID to the first child PID
+        processes.append(pid)
 
     # Close all pipe fds in the parent process
     for fd_pair in pipe_fds:
@@ -456,33 +626,42 @@ def run_command_with_pipes(command):
 
 def parse_command(cmd):
     """Parse the command string into arguments, preserving escape sequences."""
+    import shlex
     lexer = shlex.shlex(cmd, posix=True)
     lexer.whitespace_split = True
     lexer.escape = ''  # Disable shlex's escape handling to preserve backslashes
     lexer.quotes = "'\""  # Allow both single and double quotes
 
     try:
+        tokens = list(lexer)
+    except ValueError:
+        print("mysh: syntax error: unterminated quote", file=sys.stderr)
+        return None
+
+    # Tokens only need re-joining when one of them still starts with a quote
+    # character (e.g. a single quote nested inside double quotes)
+    if any(token.startswith(("'", '"')) for token in tokens):
         args = []
-        current_arg = ''
+        current_arg = []
         in_quotes = False
         quote_char = ''
 
-        for token in lexer:
-            if not in_quotes and (token.startswith("'") or token.startswith('"')):
+        for token in tokens:
+            if not in_quotes and token.startswith(("'", '"')):
                 # Starting a new quoted string
                 in_quotes = True
                 quote_char = token[0]
-                current_arg = token
+                current_arg = [token]
             elif in_quotes and token.endswith(quote_char):
                 # Ending the quoted string
                 in_quotes = False
-                current_arg += ' ' + token
-                args.append(current_arg)
-                current_arg = ''
+                current_arg.append(token)
+                args.append(' '.join(current_arg))
+                current_arg = []
                 quote_char = ''
             elif in_quotes:
                 # Inside a quoted string, accumulate tokens
-                current_arg += ' ' + token
+                current_arg.append(token)
             else:
                 # Regular token outside of quotes
                 args.append(token)
@@ -491,20 +670,17 @@ def parse_command(cmd):
         if in_quotes:
             print("mysh: syntax error: unterminated quote", file=sys.stderr)
             return None
+    else:
+        args = tokens
 
-        processed_args = []
-        for arg in args:
-            # Check if the argument is a variable with invalid characters
-            if arg.startswith('${') and arg.endswith('}'):
-                var_name = arg[2:-1]
-                if not is_valid_variable_name(var_name):
-                    print(f"mysh: syntax error: invalid characters for variable {var_name}", file=sys.stderr)
-                    return None
-            processed_args.append(re.sub(r'\\\$', r'\\$', arg))
-        return processed_args
-    except ValueError:
-        print("mysh: syntax error: unterminated quote", file=sys.stderr)
-        return None
+    for arg in args:
+        # Check if the argument is a variable with invalid characters
+        if arg.startswith('${') and arg.endswith('}'):
+            var_name = arg[2:-1]
+            if not is_valid_variable_name(var_name):
+                print(f"mysh: syntax error: invalid characters for variable {var_name}", file=sys.stderr)
+                return None
+    return args
 
 
 
@@ -512,7 +688,7 @@ def parse_command(cmd):
 def execute_command(args):
     """Execute external commands with arguments using the current PATH."""
     # Expand tilde (~) in the command arguments
-    args = [os.path.expanduser(arg) for arg in args]
+    args = [_expand_tilde(arg) for arg in args]
 
     # Check if the command is a local file or executable in PATH
     cmd = args[0]
@@ -525,21 +701,8 @@ def execute_command(args):
             return
 
         # Otherwise, run the built-in command directly
-        if cmd == "echo":
-            echo_command(args[1:])
-            return
-        elif cmd == "pwd":
-            pwd_command(args[1:])
-            return
-        elif cmd == "cd":
-            cd_command(args[1:])
-            return
-        elif cmd == "which":
-            which_command(args[1:])
-            return
-        elif cmd == "var":
-            var_command(args[1:])
-            return
+        _BUILTINS[cmd](args[1:])
+        return
 
     # Check if the command is a local file
     if os.path.isfile(cmd):
@@ -558,33 +721,47 @@ def execute_command(args):
         print(f"mysh: command not found: {cmd}", file=sys.stderr)
         return
 
-    pid = os.fork()
-    if pid == 0:  # Child process
-        os.setpgrp()  # Set the child as the leader of a new process group
-        try:
-            # Execute the command using the executable found or provided path
-            os.execvp(executable, args)
-        except FileNotFoundError:
-            print(f"mysh: command not found: {cmd}", file=sys.stderr)
-        except PermissionError:
-            print(f"mysh: permission denied: {cmd}", file=sys.stderr)
-        except Exception as e:
-            print(f"Error executing {cmd}: {e}", file=sys.stderr)
-        sys.exit(1)  # Exit the child process if exec fails
-    else:  # Parent process
-        # Ignore SIGINT in the shell and pass it to the child process group
-        old_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
-        try:
-            # Wait for the child process to finish
-            os.waitpid(pid, 0)
-        except KeyboardInterrupt:
-            # Send SIGINT to the process group of the child
-            os.killpg(pid, signal.SIGINT)
-        finally:
-            # Restore the previous SIGINT handler
-            signal.signal(signal.SIGINT, old_handler)
+    try:
+        # Execute the command using the executable found or provided path, as the
+        # leader of a new process group. Python ignores SIGPIPE, so restore its
+        # default action in the child as subprocess does.
+        pid = os.posix_spawnp(executable, args, os.environ, setpgroup=0,
+                              setsigdef=(signal.SIGPIPE,))
+    except FileNotFoundError:
+        _exec_cache.pop(cmd, None)  # Forget a cached path that no longer exists
+        print(f"mysh: command not found: {cmd}", file=sys.stderr)
+        return
+    except PermissionError:
+        print(f"mysh: permission denied: {cmd}", file=sys.stderr)
+        return
+    except Exception as e:
+        print(f"Error executing {cmd}: {e}", file=sys.stderr)
+        return
+
+    # Ignore SIGINT in the shell and pass it to the child process group
+    old_handler = signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        # Wait for the child process to finish
+        os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        # Send SIGINT to the process group of the child
+        os.killpg(pid, signal.SIGINT)
+    finally:
+        # Restore the previous SIGINT handler
+        signal.signal(signal.SIGINT, old_handler)
+
 
 
+# Handlers for the commands the shell runs itself, keyed by command name
+_BUILTINS = {
+    "exit": exit_command,
+    "pwd": pwd_command,
+    "cd": cd_command,
+    "which": which_command,
+    "var": var_command,
+    "echo": echo_command,
+}
+
 
 def initialize_default_environment():
     """Initialize default environment variables for the shell."""
@@ -612,36 +789,25 @@ def main() -> None:
     while True:
         try:
             # Use the dynamic prompt display
-            cmd = input(os.environ.get('PROMPT_DISPLAY', '>> ')).strip()
+            cmd = input(_PROMPT_DISPLAY).strip()
             if not cmd:
                 continue
 
-            # Check for syntax error if there is a missing command after a pipe
-            if '|' in cmd and not check_pipe_syntax(cmd.split('|')):
-                continue  # Skip further execution if there's a pipe syntax error
-
-            # Handle piping separately
-            if '|' in cmd:
-                run_command_with_pipes(cmd)
-                continue
+            # Handle piping separately, checking for a missing command after a pipe.
+            # Split by pipe while preserving quoted pipes
+            pipe_commands = _split_pipes(cmd)
+            if len(pipe_commands) > 1:
+                if check_pipe_syntax(pipe_commands):
+                    run_command_with_pipes(pipe_commands)
+                continue  # The pipeline (or its syntax error) has been handled
 
             args = parse_command(cmd)
             if args is None:
                 continue
 
-            command = args[0]
-            if command == "exit":
-                exit_command(args[1:])
-            elif command == "pwd":
-                pwd_command(args[1:])
-            elif command == "cd":
-                cd_command(args[1:])
-            elif command == "which":
-                which_command(args[1:])
-            elif command == "var":
-                var_command(args[1:])
-            elif command == "echo":
-                echo_command(args[1:])
+            handler = _BUILTINS.get(args[0])
+            if handler is not None:
+                handler(args[1:])
             else:
                 execute_command(args)  # Execute non-built-in commands
         except EOFError: